@@ -1,16 +1,24 @@
+import asyncio
+import hashlib
 import json
 import os
 import random
 import re
+import sqlite3
 import time
 
+import diskcache
 import dotenv
+import httpx
+import jmespath
 import openai
-import requests
-from parsel import Selector
-from scrapfly import ScrapeConfig, ScrapflyClient
+import orjson
+from scrapfly import ScrapeConfig, ScrapflyClient, ScrapflyError
+from selectolax.lexbor import LexborHTMLParser
 from telegram import Bot
-from telegram.error import RetryAfter, TimedOut
+from telegram.error import BadRequest, RetryAfter, TelegramError, TimedOut
+from telegram.request import HTTPXRequest
+from tenacity import retry, retry_if_exception, retry_if_exception_type, stop_after_attempt, wait_exponential_jitter
 
 # Import search parameters and criteria from the search_config module
 from search_config import (
@@ -27,107 +35,286 @@ from search_config import (
     CRITERES_INTERESSANTS,
 )
 
+# Load the .env file before any environment variable is read below
 dotenv.load_dotenv()
 
+# Fail early with a clear message rather than running with missing credentials
+REQUIRED_ENV_VARS = ('TELEGRAM_BOT_TOKEN', 'TELEGRAM_CHAT_ID', 'OPENAI_API_KEY', 'SCRAPFLY_API_KEY')
+missing_env_vars = [name for name in REQUIRED_ENV_VARS if not os.getenv(name)]
+if missing_env_vars:
+    raise SystemExit(f"Missing environment variables: {', '.join(missing_env_vars)}. Set them in the .env file.")
+
 #################   CONFIGURATION   #################
 # State restoration files
-PROCESSED_ANNOUNCEMENTS_FILE = 'processed_urls.json' # File to load and save processed URLs
-RESULTS_FILE = 'announcement_results.json'  # File to load and save page description
+PROCESSED_ANNOUNCEMENTS_FILE = 'processed_announcements.txt' # File to load and append processed announcement IDs, one per line
+LEGACY_PROCESSED_ANNOUNCEMENTS_FILE = 'processed_urls.json'  # Former JSON list of processed IDs, imported once
+RESULTS_FILE = 'announcement_results.db'  # SQLite database to load and save page descriptions, one row per announcement
+LEGACY_RESULTS_FILE = 'announcement_results.json'  # Former JSON file of page descriptions, imported once
+SCRAPE_CACHE_DIR = '.scrape_cache'  # Directory caching the __NEXT_DATA__ JSON of announcement pages
+SCRAPE_CACHE_TTL = 24 * 3600  # seconds before a cached announcement page is scraped again
+scrape_cache = diskcache.Cache(SCRAPE_CACHE_DIR)
+LLM_CACHE_DIR = '.llm_cache'  # Directory caching GPT verdicts and summaries by announcement content
+LLM_CACHE_TTL = 30 * 24 * 3600  # seconds before a cached GPT answer is asked again
+llm_cache = diskcache.Cache(LLM_CACHE_DIR)
 
 # Constants for easy changes
 BASE_URL = "https://www.seloger.com"
-ANNOUNCEMENT_URL_SELECTOR = 'a[data-testid="sl.explore.coveringLink"]::attr(href)'
+ANNOUNCEMENT_URL_SELECTOR = 'a[data-testid="sl.explore.coveringLink"]'
+NEXT_DATA_SELECTOR = 'script#__NEXT_DATA__'
+TOTAL_ANNOUNCEMENTS_PATTERN = re.compile(r'(\d+) annonces')  # Total count in the search results title
+ANNOUNCEMENT_ID_PATTERN = re.compile(r'/(\d+)\.htm')  # Announcement ID in an announcement URL
 
-QUARTIER_SELECTOR = 'props.pageProps.listingData.listing.listingDetail.address'
-DESCRIPTION_SELECTOR = 'props.pageProps.listingData.listing.listingDetail.descriptive'
-ADDITIONAL_INFO_SELECTOR = 'props.pageProps.listingData.listing.listingDetail.featureCategories'
-IMAGE_SELECTOR = 'props.pageProps.listingData.listing.listingDetail.media.photos[0].originalUrl'
+# JMESPath expressions, compiled once, locating the details in the __NEXT_DATA__ JSON
+QUARTIER_SELECTOR = jmespath.compile('props.pageProps.listingData.listing.listingDetail.address')
+DESCRIPTION_SELECTOR = jmespath.compile('props.pageProps.listingData.listing.listingDetail.descriptive')
+ADDITIONAL_INFO_SELECTOR = jmespath.compile('props.pageProps.listingData.listing.listingDetail.featureCategories')
+IMAGE_SELECTOR = jmespath.compile('props.pageProps.listingData.listing.listingDetail.media.photos[0].originalUrl')
 
 
 # Telegram bot configuration
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 TELEGRAM_CHAT_ID = os.getenv('TELEGRAM_CHAT_ID')  # Your personal chat id or a group chat id where the bot is added.
 MAX_CAPTION_LENGTH = 1024
-RETRY_DELAY = 5  # seconds to wait before retrying
+# Parts of the BadRequest messages returned when Telegram cannot fetch a photo from its URL
+PHOTO_URL_ERRORS = ('http url', 'web page content', 'file identifier')
 MAX_RETRIES = 5  # maximum number of retries
-tg_bot = Bot(token=TELEGRAM_BOT_TOKEN)
+BACKOFF_WAIT = wait_exponential_jitter(max=30)  # exponential backoff with jitter between retries
+# Pooled HTTP/2 connections, reused by every message sent by the bot
+tg_bot = Bot(token=TELEGRAM_BOT_TOKEN, request=HTTPXRequest(connection_pool_size=10, http_version="2"))
 
 # OpenAI API configuration
-openai.api_key = os.getenv('OPENAI_API_KEY')
-GPT_MODEL = "gpt-4-1106-preview"
+# The client retries rate limited (429) and failed requests with exponential backoff
+openai_client = openai.AsyncOpenAI(api_key=os.getenv('OPENAI_API_KEY'), max_retries=MAX_RETRIES)
+GPT_MODEL = "gpt-4-1106-preview"  # Model writing the summaries of interesting announcements
+CLASSIFICATION_MODEL = "gpt-4o-mini"  # Cheaper model deciding which announcements are interesting
+CLASSIFICATION_BATCH_SIZE = 20  # Number of announcements evaluated in a single GPT call
+GPT_CONCURRENCY = 5  # maximum simultaneous summary requests, keep it within your OpenAI rate limits
+
+# HTTP client shared by the image downloads, keeps connections alive between requests
+http_client = httpx.AsyncClient(http2=True, follow_redirects=True, limits=httpx.Limits(max_connections=20))
 
 # Scrapfly API configuration
 SCRAPFLY_API_KEY = os.getenv('SCRAPFLY_API_KEY')
+SCRAPFLY_CONCURRENCY = 5  # maximum simultaneous scrapes, keep it within your Scrapfly concurrency quota
+SCRAPFLY_RATE_LIMIT_DELAY = 5  # seconds to pause every scrape once the Scrapfly rate limit is almost reached
+scrapfly_paused_until = 0.0  # time.monotonic() value before which no scrape is dispatched
+
+################## Retry management ##################
+def retry_with_backoff(retry_condition, wait=BACKOFF_WAIT, **kwargs):
+    """
+    Build a tenacity decorator retrying a function up to MAX_RETRIES times when the given
+    condition matches the raised exception, waiting with exponential backoff between attempts.
+
+    :param retry_condition: A tenacity retry condition, e.g. retry_if_exception_type(...).
+    :param wait: A tenacity wait strategy, BACKOFF_WAIT by default.
+    :param kwargs: Additional arguments passed to tenacity.retry.
+    :return: The decorator. Once retries are exhausted the last exception is re-raised.
+    """
+    return retry(
+        retry=retry_condition,
+        wait=wait,
+        stop=stop_after_attempt(MAX_RETRIES),
+        reraise=True,
+        **kwargs
+    )
+
+def wait_telegram_retry_after(retry_state):
+    """Wait for the delay requested by Telegram when rate limited, otherwise back off exponentially."""
+    exception = retry_state.outcome.exception()
+    if isinstance(exception, RetryAfter):
+        print(f"Rate limit exceeded, sleeping for {exception.retry_after} seconds")
+        return exception.retry_after
+    return BACKOFF_WAIT(retry_state)
+
+def report_telegram_message_failure(retry_state):
+    print('Failed to send Telegram message after retries')
+
+def report_telegram_photo_failure(retry_state):
+    print('Failed to send Telegram photo after retries')
+
 
 ############ State restoration management ############
-# Function to save results to a file
-def save_results(data):
+# Function to open the results database
+def connect_results_db():
     """
-    Save the given data to a file in JSON format.
+    Open the SQLite database at RESULTS_FILE, creating the announcements table if needed.
 
-    The RESULTS_FILE global variable should contain the file path where
-    the data will be saved. This function opens that file in write mode
-    and writes the data as JSON.
+    The database uses write-ahead logging so that each announcement can be committed as
+    soon as it is scraped, without rewriting the previous results.
+
+    Returns:
+        sqlite3.Connection: An open connection to the results database.
+    """
+    connection = sqlite3.connect(RESULTS_FILE)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS announcements ('
+        'id TEXT PRIMARY KEY, url TEXT, description TEXT, additional_info TEXT, image TEXT)'
+    )
+    return connection
+
+# Function to save a result to the database
+def save_result(connection, details):
+    """
+    Insert or replace the details of a single announcement in the results database.
 
     Args:
-        data: The data to be saved. It must be serializable by the json module.
+        connection (sqlite3.Connection): An open connection to the results database.
+        details (dict): The announcement details, with the 'id', 'url', 'description',
+                        'additional_info' and 'image' keys.
 
     Returns:
         None
     """
-    with open(RESULTS_FILE, 'w') as file:
-        json.dump(data, file)
-
-# Function to load results from a file
-def load_results():
+    with connection:
+        connection.execute(
+            'INSERT OR REPLACE INTO announcements (id, url, description, additional_info, image) '
+            'VALUES (:id, :url, :description, :additional_info, :image)',
+            details,
+        )
+
+# Function to import the results of the former JSON file
+def import_legacy_results(connection, legacy_file_path):
     """
-    Load results from a JSON file.
+    Import the announcements of the former JSON results file into the results database.
+
+    Images used to be downloaded locally, so image paths that are not URLs are dropped.
+
+    Args:
+        connection (sqlite3.Connection): An open connection to the results database.
+        legacy_file_path (str): The path of the JSON file holding the former results.
 
-    This function attempts to open a file specified by the constant RESULTS_FILE,
-    parse its JSON content, and return the resulting dictionary. If the file does
-    not exist, or if an error occurs during parsing (e.g., due to invalid JSON), 
-    the function will return an empty dictionary.
     Returns:
-        dict: A dictionary containing the parsed JSON data, or an empty dictionary
-              if the file does not exist or the JSON is invalid.
+        None
     """
     try:
-        with open(RESULTS_FILE, 'r') as file:
-            return json.load(file)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return {}  # Return an empty dictionary if file does not exist or is empty/corrupt
+        with open(legacy_file_path, 'r') as file:
+            legacy_results = json.load(file)
+    except json.JSONDecodeError:
+        print(f"Could not import {legacy_file_path}, its content is not valid JSON")
+        return
+
+    imported = 0
+    for annonce_id, details in legacy_results.items():
+        if not details:
+            continue  # Announcements whose scrape failed were saved as null
+        image = details.get('image')
+        save_result(connection, {
+            'id': annonce_id,
+            'url': details.get('url'),
+            'description': details.get('description'),
+            'additional_info': details.get('additional_info'),
+            'image': image if isinstance(image, str) and image.startswith('http') else 'Unknown image',
+        })
+        imported += 1
+    print(f"Imported {imported} announcements from {legacy_file_path}")
+
+# Function to load results from the database
+def load_results(connection):
+    """
+    Load the details of every announcement saved in the results database.
+
+    If the database is empty and LEGACY_RESULTS_FILE exists, the former JSON results
+    are imported into it first.
+
+    Args:
+        connection (sqlite3.Connection): An open connection to the results database.
+
+    Returns:
+        dict: A dictionary containing the details of each announcement keyed by their IDs,
+              or an empty dictionary if no announcement has been saved yet.
+    """
+    connection.row_factory = sqlite3.Row
+    query = 'SELECT id, url, description, additional_info, image FROM announcements'
+    rows = connection.execute(query).fetchall()
+    if not rows and os.path.exists(LEGACY_RESULTS_FILE):
+        import_legacy_results(connection, LEGACY_RESULTS_FILE)
+        rows = connection.execute(query).fetchall()
+    return {row['id']: dict(row) for row in rows}
+
+# Function to open the results database and load its results
+def open_results_db():
+    """
+    Open the results database and load the results it contains.
 
-# Load processed URLs from a file
+    If the database is corrupt, it is moved aside to RESULTS_FILE + '.corrupt' and an empty
+    database is started instead, so the run goes on from scratch rather than failing. Operational
+    errors, such as a locked database or a disk I/O error, are raised as is.
+
+    Returns:
+        tuple: An open sqlite3.Connection to the results database, and the dictionary of results
+               returned by load_results.
+    """
+    connection = None
+    try:
+        connection = connect_results_db()
+        return connection, load_results(connection)
+    except sqlite3.DatabaseError as e:
+        if connection is not None:
+            connection.close()
+        if isinstance(e, sqlite3.OperationalError):
+            raise  # The database may be healthy, don't move it aside
+        print(f"Results database {RESULTS_FILE} is corrupt ({e}), moving it to {RESULTS_FILE}.corrupt")
+        os.replace(RESULTS_FILE, f"{RESULTS_FILE}.corrupt")
+        connection = connect_results_db()
+        return connection, load_results(connection)
+
+# Load processed announcement IDs from a file
 def load_processed_announcements(file_path):
     """
-    Load a set of processed announcement URLs from the specified file.
+    Load a set of processed announcement IDs from the specified file.
     
-    This function attempts to read a file containing JSON data and converts
-    it into a set of URLs. If the file cannot be read or the JSON data is
-    malformed, an empty set is returned instead.
+    The file is an append-only log holding one announcement ID per line. If the file does
+    not exist yet, it is first seeded from LEGACY_PROCESSED_ANNOUNCEMENTS_FILE when that older
+    JSON file exists, otherwise an empty set is returned.
     
     Parameters:
-    - file_path (str): The path to the file containing the processed URLs in JSON format.
+    - file_path (str): The path to the file containing the processed announcement IDs.
     Returns:
-    - set: A set containing the processed URLs, or an empty set if the file cannot be
-           read or the JSON content cannot be decoded.
+    - set: A set containing the processed announcement IDs, or an empty set if the file
+           does not exist.
     """
+    if not os.path.exists(file_path) and os.path.exists(LEGACY_PROCESSED_ANNOUNCEMENTS_FILE):
+        migrate_processed_announcements(LEGACY_PROCESSED_ANNOUNCEMENTS_FILE, file_path)
+
     try:
         with open(file_path, 'r') as file:
-            return set(json.load(file))
-    except (FileNotFoundError, json.JSONDecodeError):
+            return set(file.read().splitlines())
+    except FileNotFoundError:
         return set()
 
-# Save processed URLs to a file
-def save_processed_announcements(file_path, processed_announcements):
+# Import processed announcement IDs from the former JSON file
+def migrate_processed_announcements(legacy_file_path, file_path):
     """
-    Save a list of processed announcement IDs to a file in JSON format.
+    Write the announcement IDs of the former JSON list file to the append-only log, one per line.
 
+    :param legacy_file_path: The path of the JSON file holding the list of processed announcement IDs.
     :param file_path: The path of the file where the processed announcement IDs will be stored.
-    :param processed_announcements: A set or list of processed announcement IDs to be saved.
     """
+    try:
+        with open(legacy_file_path, 'r') as file:
+            processed_announcements = json.load(file)
+    except json.JSONDecodeError:
+        print(f"Could not import {legacy_file_path}, its content is not valid JSON")
+        return
+
     with open(file_path, 'w') as file:
-        json.dump(list(processed_announcements), file)
+        file.writelines(f"{annonce_id}\n" for annonce_id in processed_announcements)
+    print(f"Imported {len(processed_announcements)} processed announcements from {legacy_file_path}")
+
+# Append a processed announcement ID to a file
+def mark_processed(file_path, annonce_id):
+    """
+    Append a processed announcement ID to the given file.
+
+    Only the new ID is written, so progress is kept if the run stops halfway
+    and the file never has to be rewritten as it grows.
+
+    :param file_path: The path of the file where the processed announcement IDs are stored.
+    :param annonce_id: The ID of the announcement that has been processed.
+    """
+    with open(file_path, 'a') as file:
+        file.write(f"{annonce_id}\n")
 
 def should_process_announcement(annonce_id, processed_announcements):
     """
@@ -154,6 +341,11 @@ def create_message(url: str, data: dict) -> str:
     message += f"Description:\n{data['resume']}\n"
     return message
 
+@retry_with_backoff(
+    retry_if_exception_type((RetryAfter, TimedOut)),
+    wait=wait_telegram_retry_after,
+    retry_error_callback=report_telegram_message_failure,
+)
 async def send_telegram_message(bot, message: str):
     """
     Attempts to send a Telegram message with retries on failure due to rate limits or timeouts.
@@ -163,21 +355,61 @@ async def send_telegram_message(bot, message: str):
     - message (str): The message text to be sent.
 
     Exceptions:
-    - RetryAfter: If rate limits are exceeded, the bot waits and retries as indicated.
-    - TimedOut: If a timeout occurs, the bot will retry until max retries are exceeded.
+    - RetryAfter: If rate limits are exceeded, the bot waits as indicated and retries.
+    - TimedOut: If a timeout occurs, the bot backs off exponentially and retries until max retries are exceeded.
+    """
+    await bot.send_message(chat_id=TELEGRAM_CHAT_ID, text=message, parse_mode='Markdown')  # Use await
+
+@retry_with_backoff(
+    retry_if_exception_type((RetryAfter, TimedOut)),
+    wait=wait_telegram_retry_after,
+    retry_error_callback=report_telegram_photo_failure,
+)
+async def send_photo(bot, photo, caption: str):
+    """
+    Attempts to send a Telegram photo with retries on failure due to rate limits or timeouts.
+
+    Parameters:
+    - bot: The Telegram bot instance to send messages with.
+    - photo: The photo to send, as a URL or bytes.
+    - caption (str): The caption of the photo.
+
+    Exceptions:
+    - RetryAfter: If rate limits are exceeded, the bot waits as indicated and retries.
+    - TimedOut: If a timeout occurs, the bot backs off exponentially and retries until max retries are exceeded.
+    """
+    await bot.send_photo(chat_id=TELEGRAM_CHAT_ID, photo=photo, caption=caption, parse_mode='Markdown')
+
+async def send_telegram_photo(bot, data: dict):
     """
-    for attempt in range(MAX_RETRIES):
+    Sends the announcement image with its title as caption.
+
+    The image URL is given to Telegram, which fetches the image itself. If Telegram cannot
+    fetch the URL, the image is downloaded in memory and uploaded instead. Other failures
+    are logged and the photo is skipped.
+
+    Parameters:
+    - bot: The Telegram bot instance to send messages with.
+    - data (dict): Data containing the 'titre' (title) and 'img' (image URL) of the announcement.
+    """
+    caption = f"Title: {data['titre']}"
+    try:
+        await send_photo(bot, data['img'], caption)
+    except BadRequest as e:
+        if not any(error in e.message.lower() for error in PHOTO_URL_ERRORS):
+            print(f"Failed to send the image {data['img']}: {e}")
+            return
+        print(f"Telegram could not fetch the image {data['img']} ({e}), uploading it")
         try:
-            await bot.send_message(chat_id=TELEGRAM_CHAT_ID, text=message, parse_mode='Markdown')  # Use await
-            break  # Message sent successfully
-        except RetryAfter as e:
-            print(f"Rate limit exceeded, sleeping for {e.retry_after} seconds")
-            time.sleep(e.retry_after)
-        except TimedOut:
-            if attempt < MAX_RETRIES - 1:  # Don't sleep after the last attempt
-                time.sleep(RETRY_DELAY)
-            else:
-                print('Failed to send Telegram message after retries')
+            photo = await download_image(data['img'])
+        except httpx.HTTPError as e:
+            print(f"Failed to download the image {data['img']}: {e}")
+            return
+        if photo:
+            try:
+                await send_photo(bot, photo, caption)
+            except TelegramError as e:
+                print(f"Failed to upload the image {data['img']}: {e}")
 
 async def send_telegram_info(bot, annonce_id: str, data: dict):
     """
@@ -187,29 +419,14 @@ async def send_telegram_info(bot, annonce_id: str, data: dict):
     - bot: The Telegram bot instance to send messages with.
     - annonce_id (str): The announcement id, not currently used in this function.
     - data (dict): Data containing the necessary information for constructing the message.
-                   Expected keys include 'url', 'titre', 'resume', and optionally 'img'.
+                   Expected keys include 'url', 'titre', 'resume', and optionally 'img' (image URL).
 
-    Exceptions:
-    - TimedOut: If a timeout occurs, the bot will retry until max retries are exceeded.
+    Rate limits and timeouts are retried with backoff by send_photo and send_telegram_message.
     """
     message = create_message(data['url'], data)
-    for attempt in range(MAX_RETRIES):
-        try:
-            if data.get('img'):  # If image is provided in data
-                if data['img'] != 'Unknown image':
-                    with open(data['img'], 'rb') as photo:
-                        await bot.send_photo(chat_id=TELEGRAM_CHAT_ID, photo=photo, caption=f"Title: {data['titre']}", parse_mode='Markdown')  # Use await
-                # Call the async function with await
-                await send_telegram_message(bot, message)  # Send the rest of the message as text
-            else:
-                # Call the async function with await
-                await send_telegram_message(bot, message)  # If no image, only send text message
-            break  # Message sent successfully
-        except TimedOut:
-            if attempt < MAX_RETRIES - 1:
-                time.sleep(RETRY_DELAY)
-            else:
-                print('Failed to send Telegram info after retries')
+    if data.get('img') and data['img'] != 'Unknown image':  # If image is provided in data
+        await send_telegram_photo(bot, data)
+    await send_telegram_message(bot, message)  # Send the rest of the message as text
 
 
 ###################### Helpers #######################
@@ -234,42 +451,84 @@ def create_search_url(projects, types, natures, insee_codes, price_min, price_ma
     return base_url + "&".join([f"{k}={v}" for k, v in params.items()])
 
 def get_total_announcements(title):
-    total_announcements_match = re.search(r'(\d+) annonces', title)
+    total_announcements_match = TOTAL_ANNOUNCEMENTS_PATTERN.search(title)
     if not total_announcements_match:
         print("Could not determine the total number of announcements from the title")
         return 0
     return int(total_announcements_match.group(1))
 
-def get_value_from_json_path(data, path: str):
-    try:
-        elements = path.split('.')
-        for elem in elements:
-            if '[' in elem and ']' in elem:
-                # Handle list index within the path
-                elem, index = elem.replace(']', '').split('[')
-                data = data.get(elem)[int(index)]
-            else:
-                data = data.get(elem)
-        return data
-    except (IndexError, KeyError, TypeError):
+@retry_with_backoff(retry_if_exception_type(httpx.HTTPError))
+async def download_image(image_url):
+    response = await http_client.get(image_url)
+    if response.status_code == 429 or response.status_code >= 500:
+        response.raise_for_status()  # Transient error, let the download be retried
+    if response.status_code != 200:
         return None
+    return response.content
 
-def download_image(image_url):
-    response = requests.get(image_url)
-    if response.status_code == 200:
-        file_name = f"img/{os.path.basename(image_url)}.jpg"
-        with open(file_name, 'wb') as f:
-            f.write(response.content)
-        return file_name
-    return None
+@retry_with_backoff(retry_if_exception(lambda e: isinstance(e, ScrapflyError) and e.is_retryable))
+async def scrape(scrapfly_client, scrape_config):
+    """
+    Scrape a page with Scrapfly, retrying retryable Scrapfly errors with exponential backoff.
+
+    When the X-RateLimit-Remaining header shows that the rate limit is almost reached,
+    every scrape waits SCRAPFLY_RATE_LIMIT_DELAY seconds before its dispatch.
+    """
+    global scrapfly_paused_until
+    # Wait while the rate limit pause is on, it may be extended by another scrape meanwhile
+    delay = scrapfly_paused_until - time.monotonic()
+    while delay > 0:
+        await asyncio.sleep(delay)
+        delay = scrapfly_paused_until - time.monotonic()
+    result = await scrapfly_client.async_scrape(scrape_config)
+    remaining = result.headers.get('X-RateLimit-Remaining', '')
+    if remaining.isdigit() and int(remaining) <= 1:
+        print(f"Scrapfly rate limit almost reached, pausing for {SCRAPFLY_RATE_LIMIT_DELAY} seconds")
+        scrapfly_paused_until = time.monotonic() + SCRAPFLY_RATE_LIMIT_DELAY
+    return result
 
 def clean_text(text):
     return ' '.join(text.split())
 
+def format_additional_info(feature_categories):
+    """
+    Flatten the announcement feature categories into a compact "- title: value" list,
+    keeping only the features' titles and values to limit the tokens sent to GPT.
+    """
+    lines = []
+    for category in feature_categories:
+        if not isinstance(category, dict):
+            continue
+        for feature in category.get('features') or []:
+            if not isinstance(feature, dict) or not feature.get('title'):
+                continue
+            if feature.get('value') is not None:
+                lines.append(f"- {clean_text(str(feature['title']))}: {clean_text(str(feature['value']))}")
+            else:
+                lines.append(f"- {clean_text(str(feature['title']))}")
+    return '\n'.join(lines)
+
+def extract_next_data(content):
+    node = LexborHTMLParser(content).css_first(NEXT_DATA_SELECTOR)
+    return node.text() if node else None
+
+def get_announcement_links(tree):
+    return [node.attributes['href'] for node in tree.css(ANNOUNCEMENT_URL_SELECTOR) if node.attributes.get('href')]
+
 def extract_announcement_id(url):
-    match = re.search(r'/(\d+)\.htm', url)
+    match = ANNOUNCEMENT_ID_PATTERN.search(url)
     return match.group(1) if match else None
 
+def llm_cache_key(*parts):
+    # Serialize the parts as a JSON list so that different splits of the same text can't collide
+    return hashlib.blake2b(orjson.dumps(parts)).hexdigest()
+
+def classification_cache_key(description, additional_info):
+    return llm_cache_key('classification', CLASSIFICATION_MODEL, CRITERES_INTERESSANTS, description, additional_info)
+
+def summary_cache_key(description, additional_info):
+    return llm_cache_key('summary', GPT_MODEL, description, additional_info)
+
 
 
 ############## Anouncements management ###############
@@ -279,9 +538,13 @@ async def parse_announcements(announcements_data: dict) -> dict:
     Parse a dictionary of announcements, ask GPT for insights and send the info through Telegram.
 
     The function iterates through the given announcement data, checks if the announcement
-    has already been processed, and if not, it uses the GPT to analyze the announcement.
-    If the result is marked 'interessante', it sends the information through Telegram.
-    All processed announcement IDs are stored to avoid reprocessing.
+    has already been processed, and if not, sends it to GPT to analyze it. Announcements are
+    evaluated by batches of CLASSIFICATION_BATCH_SIZE in a single GPT call, and only those
+    marked 'interessante' are summarized by GPT, concurrently with at most GPT_CONCURRENCY
+    requests in flight, and sent through Telegram in order.
+    Each processed announcement ID is appended to PROCESSED_ANNOUNCEMENTS_FILE as soon as
+    it is handled, to avoid reprocessing. Announcements GPT failed to evaluate or to summarize
+    are left unprocessed so that they are handled again on the next run.
 
     Args:
         announcements_data (dict): A dictionary with announcement IDs as keys and data as values.
@@ -289,31 +552,66 @@ async def parse_announcements(announcements_data: dict) -> dict:
     Returns:
         dict: A dictionary of processed announcements.
     """
-    items_to_parse = announcements_data.items()
     processed_announcements = load_processed_announcements(PROCESSED_ANNOUNCEMENTS_FILE)
 
-    for annonce_id, details in items_to_parse:
+    items_to_parse = []
+    for annonce_id, details in announcements_data.items():
         if should_process_announcement(annonce_id, processed_announcements):
-            print(f"Asking GPT about {annonce_id}")
-            result = ask_gpt(details['description'], details['additional_info'], details['image'], details['url'])
-            if result.get('interessante'):
-                await send_telegram_info(bot=tg_bot, annonce_id=annonce_id, data=result)
-            processed_announcements.add(annonce_id)
+            items_to_parse.append((annonce_id, details))
         else:
             print(f"Skipping {annonce_id}")
 
-    save_processed_announcements(PROCESSED_ANNOUNCEMENTS_FILE, processed_announcements)
+    semaphore = asyncio.Semaphore(GPT_CONCURRENCY)
+
+    async def bounded_ask_gpt(annonce_id, details, titre):
+        async with semaphore:
+            print(f"Annonce {annonce_id} intéressante, génération du résumé")
+            try:
+                return await ask_gpt(details['description'], details['additional_info'], details['image'], details['url'], titre)
+            except openai.OpenAIError as e:
+                print(f"GPT failed to summarize {annonce_id}, it will be retried on the next run: {e}")
+                return None
+
+    for batch_start in range(0, len(items_to_parse), CLASSIFICATION_BATCH_SIZE):
+        batch = dict(items_to_parse[batch_start:batch_start + CLASSIFICATION_BATCH_SIZE])
+        print(f"Asking GPT about {', '.join(batch)}")
+        try:
+            verdicts = await classify_announcements(batch)
+        except openai.OpenAIError as e:
+            print(f"GPT failed to classify {', '.join(batch)}, they will be retried on the next run: {e}")
+            continue
+
+        # Summarize the interesting announcements of the batch concurrently
+        interesting = {annonce_id: verdict['titre'] for annonce_id, verdict in verdicts.items() if verdict['interessante']}
+        summaries = await asyncio.gather(*[
+            bounded_ask_gpt(annonce_id, batch[annonce_id], titre) for annonce_id, titre in interesting.items()
+        ])
+        results = {annonce_id: summary for annonce_id, summary in zip(interesting, summaries) if summary is not None}
+        not_summarized = set(interesting) - set(results)
+
+        for annonce_id in batch:
+            if annonce_id not in verdicts:
+                print(f"GPT did not evaluate {annonce_id}, it will be retried on the next run")
+
+        # Send the interesting announcements one after the other, so that each photo stays next to its summary
+        for annonce_id in batch:
+            if annonce_id not in verdicts or annonce_id in not_summarized:
+                continue
+            if annonce_id in results:
+                await send_telegram_info(bot=tg_bot, annonce_id=annonce_id, data=results[annonce_id])
+            processed_announcements.add(annonce_id)
+            mark_processed(PROCESSED_ANNOUNCEMENTS_FILE, annonce_id)
 
 # Function to get the URLs of all announcements
-def get_announcement_urls(scrapfly_client, start_url, announcements_per_page=25):
+async def get_announcement_urls(scrapfly_client, start_url, announcements_per_page=25):
     """
     Retrieves a list of URLs for real estate announcements from a paginated search result on a website.
 
     This function uses the Scrapfly API Client to scrape the provided `start_url` for real estate announcement URLs,
-    then automatically follows pagination links to scrape subsequent pages until all announcement URLs have been 
-    gathered up to the total number of announcements. It calculates the total number of pages based on the number
-    of total announcements and the number of announcements per page, then iterates through all pages to extract
-    and compile announcement URLs from the `ANNOUNCEMENT_URL_SELECTOR`.
+    then scrapes the subsequent result pages until all announcement URLs have been gathered up to the total
+    number of announcements. It calculates the total number of pages based on the number of total announcements
+    and the number of announcements per page, then scrapes the remaining pages concurrently (at most
+    SCRAPFLY_CONCURRENCY at once) to extract and compile announcement URLs from the `ANNOUNCEMENT_URL_SELECTOR`.
 
     Args:
         scrapfly_client (ScrapflyClient): An instance of the ScrapflyClient used to scrape web content.
@@ -321,7 +619,9 @@ def get_announcement_urls(scrapfly_client, start_url, announcements_per_page=25)
         announcements_per_page (int, optional): The number of announcements expected on each page. Defaults to 25.
 
     Returns:
-        list: A list of strings, each being a complete URL to an individual real estate announcement.
+        list: A list of strings, each being a complete URL to an individual real estate announcement,
+              in the order of the result pages. Each announcement appears only once, even if it was
+              listed on several pages.
 
     Note:
         If scraping a page fails, the function prints an error message and continues to the next page.
@@ -332,7 +632,7 @@ def get_announcement_urls(scrapfly_client, start_url, announcements_per_page=25)
     print(f"Scraping page 1: {current_url}")
 
     # Fetch the first page to get the total number of announcements
-    first_page_result = scrapfly_client.scrape(ScrapeConfig(
+    first_page_result = await scrape(scrapfly_client, ScrapeConfig(
         url=current_url,
         asp=True,
         render_js=True,
@@ -342,108 +642,143 @@ def get_announcement_urls(scrapfly_client, start_url, announcements_per_page=25)
         print(f"Error retrieving the first page: {first_page_result.error}")
         return announcement_urls
 
-    first_page_selector = Selector(text=first_page_result.content)
+    first_page_tree = LexborHTMLParser(first_page_result.content)
     
     # Extract the initial set of URLs from the first page
-    links = first_page_selector.css(ANNOUNCEMENT_URL_SELECTOR).getall()
+    links = get_announcement_links(first_page_tree)
     announcement_urls += [
         BASE_URL + link.split('?')[0] if not link.startswith('http')
         else link.split('?')[0] for link in links
     ]
 
     # Get the total number of announcements from the title to calculate total pages
-    title = first_page_selector.css('title::text').get()
+    title_node = first_page_tree.css_first('title')
+    title = title_node.text() if title_node else ''
     total_announcements = get_total_announcements(title)
     total_pages = -(-total_announcements // announcements_per_page)  # Ceiling division
     print(f"Total announcements: {total_announcements}, total pages: {total_pages}")
     
-    # Scrape subsequent pages
-    for page_number in range(2, total_pages + 1):
-        current_url = f"{start_url}&LISTING-LISTpg={page_number}"
-        print(f"Scraping page {page_number}/{total_pages}: {current_url}")
-
-        result = scrapfly_client.scrape(ScrapeConfig(
-            url=current_url,
-            asp=True,
-            render_js=True,
-            auto_scroll=True
-        ))
+    # Scrape subsequent pages concurrently, their URLs only depend on the page number
+    semaphore = asyncio.Semaphore(SCRAPFLY_CONCURRENCY)
+
+    async def scrape_page(page_number):
+        page_url = f"{start_url}&LISTING-LISTpg={page_number}"
+        async with semaphore:
+            print(f"Scraping page {page_number}/{total_pages}: {page_url}")
+            try:
+                result = await scrape(scrapfly_client, ScrapeConfig(
+                    url=page_url,
+                    asp=True,
+                    render_js=True,
+                    auto_scroll=True
+                ))
+            except Exception as e:
+                print(f"Error retrieving page {page_number}: {e}")
+                return []
 
         if not result.success:
             print(f"Error retrieving page {page_number}: {result.error}")
-            continue
+            return []
 
-        selector = Selector(text=result.content)
-        links = selector.css(ANNOUNCEMENT_URL_SELECTOR).getall()
-        announcement_urls += [
+        links = get_announcement_links(LexborHTMLParser(result.content))
+        return [
             BASE_URL + link.split('?')[0] if not link.startswith('http')
             else link.split('?')[0] for link in links
         ]
 
-    return announcement_urls
+    pages_urls = await asyncio.gather(*[scrape_page(page_number) for page_number in range(2, total_pages + 1)])
+    for page_urls in pages_urls:
+        announcement_urls += page_urls
+
+    # Deduplicate announcements listed on several pages, keeping their first occurrence
+    unique_urls = {}
+    for url in announcement_urls:
+        unique_urls.setdefault(extract_announcement_id(url) or url, url)
+    return list(unique_urls.values())
+
+# Function to scrape an announcement page
+async def scrape_announcement_page(scrapfly_client: ScrapflyClient, url: str):
+    """
+    Scrapes an announcement page, rendering JavaScript only when needed.
+
+    The __NEXT_DATA__ script is rendered server side, so the page is first scraped without
+    JavaScript rendering, which is much cheaper. The page is scraped again with JavaScript
+    rendering only if that first scrape fails or its HTML lacks the __NEXT_DATA__ script.
+
+    :param scrapfly_client: An instance of ScrapflyClient used to scrape web content.
+    :param url: A string URL of the announcement page.
+    :return: The text of the __NEXT_DATA__ script, or None if the scrape failed or the
+             rendered page still lacks the script.
+    """
+    try:
+        result = await scrape(scrapfly_client, ScrapeConfig(url=url, asp=True))
+        json_data = extract_next_data(result.content) if result.success else None
+        if json_data:
+            return json_data
+        print(f"No JSON data found without JavaScript rendering on page {url}, rendering it")
+    except ScrapflyError as e:
+        print(f"Failed to scrape {url} without JavaScript rendering, rendering it: {e}")
+
+    result = await scrape(scrapfly_client, ScrapeConfig(url=url, asp=True, render_js=True))
+    json_data = extract_next_data(result.content) if result.success else None
+    return json_data or None
 
 # Function to get the details for a single announcement
-def get_announcement_details(scrapfly_client: ScrapflyClient, url: str):
+async def get_announcement_details(scrapfly_client: ScrapflyClient, url: str):
     """
     Retrieves and processes details from an announcement at the given URL using the ScrapflyClient.
     
     The function attempts to scrape the specified webpage for details such as the quartier,
     description, additional info, and an image. These details are extracted from the JSON
-    data within the webpage, if available. Furthermore, the image, if found, is downloaded
-    and saved locally in the 'img' directory, which is ensured to exist before downloading.
+    data within the webpage, if available. That JSON data is cached on disk for SCRAPE_CACHE_TTL
+    seconds so that later runs don't scrape the page again. Only the URL of the image is kept, the
+    image itself is fetched by Telegram when the announcement is sent.
     
     :param scrapfly_client: An instance of ScrapflyClient used to scrape web content.
     :param url: A string URL of the webpage where the announcement details can be found.
     :return: A dictionary with the extracted announcement details, including an ID,
-             URL, combined description and quartier, additional info, and an image path.
+             URL, combined description and quartier, additional info, and an image URL.
              If certain details are not found, default placeholder values are used.
+             None is returned if the page could not be scraped or has no JSON data.
     """
     # Default values in case information is not found
     quartier = "Unknown quartier"
     description = "Description not found"
     additional_info = "Additional info not found"
-    image_relative_path = 'Unknown image'
+    image_url = 'Unknown image'
 
-    # Ensure 'img' directory exists
-    if not os.path.exists('img'):
-        os.makedirs('img')
+    # Scrape the JSON data of the announcement page, unless it has been scraped recently
+    cache_key = hashlib.blake2b(f"{NEXT_DATA_SELECTOR} {url}".encode()).hexdigest()
+    json_data = scrape_cache.get(cache_key)
+    if json_data is None:
+        try:
+            json_data = await scrape_announcement_page(scrapfly_client, url)
+        except Exception as e:
+            print(f"An error occurred while trying to scrape {url}: {e}")
+            return None
 
-    try:
-        # Scrape the announcement page
-        result = scrapfly_client.scrape(ScrapeConfig(
-            url=url,
-            asp=True,
-            render_js=True,
-        ))
-
-        # Check if the scrape was successful
-        if not result.success:
+        # Check if the scrape was successful, only pages with JSON data are cached
+        if json_data is None:
             print(f"Failed to scrape announcement details from {url}")
             return None
 
-        # Use Parsel to parse the HTML content
-        selector = Selector(text=result.content)
+        scrape_cache.set(cache_key, json_data, expire=SCRAPE_CACHE_TTL)
 
-        # Extract the JSON data from the script tag
-        json_data = selector.css('script#__NEXT_DATA__::text').get()
-        if json_data:
-            data = json.loads(json_data)  # Parse JSON string into Python dictionary
-
-            # Use new helper function to traverse the JSON structure
-            quartier = get_value_from_json_path(data, QUARTIER_SELECTOR)
-            description = get_value_from_json_path(data, DESCRIPTION_SELECTOR)
-            additional_info = get_value_from_json_path(data, ADDITIONAL_INFO_SELECTOR)
-            
-            # If 'additional_info' is a data structure, convert it to string as needed
-            if isinstance(additional_info, (list, dict)):
-                additional_info = clean_text(str(additional_info))
+    try:
+        data = orjson.loads(json_data)  # Parse JSON string into Python dictionary
 
-            image_url_path = get_value_from_json_path(data, IMAGE_SELECTOR)
-            if image_url_path:
-                image_relative_path = download_image(image_url_path)
+        # Use the precompiled JMESPath expressions to traverse the JSON structure
+        quartier = QUARTIER_SELECTOR.search(data)
+        description = DESCRIPTION_SELECTOR.search(data)
+        additional_info = ADDITIONAL_INFO_SELECTOR.search(data)
+        
+        # If 'additional_info' is a data structure, convert it to string as needed
+        if isinstance(additional_info, list):
+            additional_info = format_additional_info(additional_info)
+        elif isinstance(additional_info, dict):
+            additional_info = clean_text(str(additional_info))
 
-        else:
-            print(f"No JSON data found on page {url}")
+        image_url = IMAGE_SELECTOR.search(data) or image_url
 
     except Exception as e:
         print(f"An error occurred while trying to get details from {url}: {e}")
@@ -453,130 +788,185 @@ def get_announcement_details(scrapfly_client: ScrapflyClient, url: str):
         'url': url,
         'description': f"{quartier} - {description}",
         'additional_info': additional_info,
-        'image': image_relative_path  # This should now contain the path where the image was saved or 'Unknown image'
+        'image': image_url  # URL of the first photo of the announcement or 'Unknown image'
     }
 
 # Function to get the data for all announcements
-def get_announcements_data():
+async def get_announcements_data():
     """
     Retrieve and process data for new real estate announcements from a given search URL.
     
     This function generates a search URL using predefined criteria and then scrapes SeLoger.com
-    to obtain URLs of individual real estate announcements. For each announcement that hasn't 
-    been processed previously, the function scrapes detailed data such as location, description,
-    additional information, and images using the Scrapfly API. The data is stored in a dictionary
-    keyed by the unique announcement IDs, and the dictionary is then saved to a file. The function
-    checks each URL to ensure it originates from SeLoger.com before processing.
+    to obtain URLs of individual real estate announcements. Announcements already listed in
+    PROCESSED_ANNOUNCEMENTS_FILE are skipped without scraping their details. For each announcement
+    that hasn't been processed previously, the function scrapes detailed data such as location, description,
+    additional information, and images using the Scrapfly API. Detail pages are scraped
+    concurrently, with at most SCRAPFLY_CONCURRENCY requests in flight at once. The details of
+    each announcement are saved to the results database as soon as they are scraped, and returned
+    in a dictionary keyed by the unique announcement IDs. The function checks each URL to ensure it originates from SeLoger.com before processing.
 
     Returns:
         dict: A dictionary containing detailed data for each announcement keyed by their IDs.
     """
-    announcements_info = load_results()  # Load existing results
-    scrapfly_client = ScrapflyClient(key=SCRAPFLY_API_KEY)
+    results_db, announcements_info = open_results_db()  # Load existing results
+    try:
+        processed_announcements = load_processed_announcements(PROCESSED_ANNOUNCEMENTS_FILE)
+        scrapfly_client = ScrapflyClient(key=SCRAPFLY_API_KEY)
     
-    url = create_search_url(
-        projects=PROJECT_BUY_EXISTING,
-        types=PROJECT_BUY_EXISTING,
-        natures=natures,
-        insee_codes=insee_codes,
-        price_min=price_min,
-        price_max=price_max,
-        surface_min=surface_min,
-        surface_max=surface_max,
-        bedrooms=bedrooms,
-        mandatorycommodities=MANDATORY_COMMODITIES,
-        garden=garden
-    )
-    print(url)
+        url = create_search_url(
+            projects=PROJECT_BUY_EXISTING,
+            types=PROJECT_BUY_EXISTING,
+            natures=natures,
+            insee_codes=insee_codes,
+            price_min=price_min,
+            price_max=price_max,
+            surface_min=surface_min,
+            surface_max=surface_max,
+            bedrooms=bedrooms,
+            mandatorycommodities=MANDATORY_COMMODITIES,
+            garden=garden
+        )
+        print(url)
+
+        announcement_urls = await get_announcement_urls(scrapfly_client, url, announcements_per_page=25)
+
+        # Select the announcements whose details still have to be scraped
+        urls_to_scrape = {}
+        for url in announcement_urls:
+            annonce_id = extract_announcement_id(url)
+            if annonce_id in processed_announcements:
+                continue  # Already sent to GPT in a previous run, no need to scrape it again
+            if annonce_id not in announcements_info and annonce_id not in urls_to_scrape:
+                if url.startswith('https://www.seloger.com'):
+                    urls_to_scrape[annonce_id] = url
+                else:
+                    print(f"Skipping non-seloger URL: {url}")
+
+        semaphore = asyncio.Semaphore(SCRAPFLY_CONCURRENCY)
+
+        async def bounded_get_announcement_details(url):
+            async with semaphore:
+                print(f"Getting details for {url}")
+                details = await get_announcement_details(scrapfly_client, url)
+            if details is not None:
+                save_result(results_db, details)  # Save each result as soon as it is scraped
+            return details
 
-    announcement_urls = get_announcement_urls(scrapfly_client, url, announcements_per_page=25)
+        results = await asyncio.gather(*[bounded_get_announcement_details(url) for url in urls_to_scrape.values()])
+        announcements_info.update(
+            (annonce_id, details) for annonce_id, details in zip(urls_to_scrape.keys(), results) if details is not None
+        )
 
-    for url in announcement_urls:
-        annonce_id = extract_announcement_id(url)
-        if annonce_id not in announcements_info:
-            if url.startswith('https://www.seloger.com'):
-                print(f"Getting details for {url}")
-                details = get_announcement_details(scrapfly_client, url)
-                announcements_info[annonce_id] = details
-            else:
-                print(f"Skipping non-seloger URL: {url}")
-    save_results(announcements_info)  # Save updated results
-    return announcements_info
+        return announcements_info
+    finally:
+        results_db.close()
 
 
 
 ##################### GPT ############################
-def ask_gpt(description: str, additional_info: str, img: str, url: str) -> dict:
+async def classify_announcements(announcements: dict) -> dict:
     """
-    Consult GPT-4 to analyze a real estate announcement and determine if it meets certain criteria.
-
-    This function formats a prompt to ask GPT-4 if a given real estate announcement is interesting based on 
-    the description, additional information provided, and a list of interesting criteria predefined in the software. 
-    If the criteria marked as 'PAS' are in the announcement, it is immediately considered not interesting.
+    Ask GPT in a single call which announcements of a batch meet the predefined criteria.
 
-    If GPT-4 deems the announcement as interesting, it is asked to provide a summary with specific formatting including 
-    details such as price, area, number of rooms, and general condition of the property.
+    This function lists every announcement of the batch (description and additional information)
+    in one prompt, along with the interesting criteria predefined in the software, and asks the
+    CLASSIFICATION_MODEL to answer with a JSON object giving, for each announcement, whether it is
+    interesting and a title. If a criterion marked 'PAS' is in an announcement, it is immediately
+    considered not interesting. Announcements without a description are not sent to GPT and are
+    considered not interesting. Verdicts are cached by announcement content, criteria and model for
+    LLM_CACHE_TTL seconds, so announcements already evaluated (e.g. re-listed under a new ID) are not
+    sent again.
 
     Args:
-        description (str): The description of the real estate property.
-        additional_info (str): Additional information that might be considered to evaluate the property.
-        img (str): The image URL or path representing the property (if any).
-        url (str): The URL of the announcement.
+        announcements (dict): A dictionary with announcement IDs as keys and details as values.
 
     Returns:
-        dict: A dictionary containing the title of the announcement, a boolean indicating if it is interesting or not, 
-              a summary provided by GPT-4, and the image path or URL. If GPT-4 cannot properly parse or interpret 
-              the information, default values for titles and summaries are returned indicating that the property is 
-              not interesting and the description is not found.
-
-    Raises:
-        json.JSONDecodeError: If the response from GPT-4 cannot be decoded.
-        KeyError: If the necessary keys are not present in GPT-4's response.
+        dict: A dictionary keyed by announcement ID, whose values contain the 'interessante' boolean and
+              the 'titre' of the announcement. Announcements GPT did not evaluate, or all of them if the
+              response cannot be decoded, are missing from the dictionary.
     """
-    if description is None:
-        return {
-            'titre': 'Titre non trouvé',
-            'interessante': False,
-            'resume': 'Description non trouvée',
-            'img': img
-        }
-    # Formulation de la prompt pour GPT-4
-    prompt = (f"Voici une description d'une annonce immobilière: {description}\n\n"
-              f"Informations supplémentaires : {additional_info}\n\n"
+    verdicts = {}
+    to_classify = {}
+    for annonce_id, details in announcements.items():
+        cached = llm_cache.get(classification_cache_key(details['description'], details['additional_info']))
+        if details['description'] is None:
+            verdicts[annonce_id] = {'interessante': False, 'titre': 'Titre non trouvé'}
+        elif cached is not None:
+            verdicts[annonce_id] = {'interessante': cached['interessante'], 'titre': cached['titre']}
+        else:
+            to_classify[annonce_id] = details
+    if not to_classify:
+        return verdicts
+
+    # Formulation de la prompt pour GPT
+    annonces = "\n\n".join(
+        f"Annonce {annonce_id} :\n"
+        f"Description : {details['description']}\n"
+        f"Informations supplémentaires : {details['additional_info']}"
+        for annonce_id, details in to_classify.items()
+    )
+    prompt = (f"Voici des descriptions d'annonces immobilières:\n\n{annonces}\n\n"
               f"Critères intéressants : {', '.join(CRITERES_INTERESSANTS)}. ATTENTION : si un critère est marqué PAS, l'annonce devient immédiatement non intéressante.\n\n"
-              'Est-ce que cette annonce répond à ces critères ? Formate ta réponse de la façon suivante : {"Interessante": true/false, "Titre": "Titre annonce"}. Il est absolument crucial que tu ne me répondes qu\'avec cette structure, sinon je ne pourrai pas comprendre ta réponse.')
-              
-    # Envoie la prompt à GPT-4 et reçoit la réponse
-    response = openai.chat.completions.create(
-        model=GPT_MODEL,
+              'Est-ce que chacune de ces annonces répond à ces critères ? Formate ta réponse comme un objet JSON de la façon suivante : {"annonces": [{"id": "identifiant annonce", "interessante": true/false, "titre": "Titre annonce"}]}, avec une entrée pour chaque annonce.')
+
+    # Envoie la prompt à GPT et reçoit la réponse
+    response = await openai_client.chat.completions.create(
+        model=CLASSIFICATION_MODEL,
+        response_format={"type": "json_object"},
         messages=[
-            {"role": "system", "content": "Tu es un agent immobilier qui reçoit une description d'une annonce immobilière. Tu dois décider si cette annonce est intéressante ou non."},
+            {"role": "system", "content": "Tu es un agent immobilier qui reçoit des descriptions d'annonces immobilières. Tu dois décider pour chacune si elle est intéressante ou non."},
             {"role": "user", "content": prompt},
         ]
     )
-    
-    # Assurez-vous que 'response' a le format correct pour accéder aux données
+
     try:
-        texte_reponse = json.loads(response.choices[0].message.content)  # Fix the access to the response data
-    except (json.JSONDecodeError, KeyError):
-        print(f"Failed to parse response from GPT-4: {response}")
+        for reponse in orjson.loads(response.choices[0].message.content)["annonces"]:
+            annonce_id = str(reponse["id"])
+            if annonce_id in to_classify:
+                verdicts[annonce_id] = {
+                    'interessante': reponse.get("interessante") is True,
+                    'titre': reponse.get("titre") or 'Titre non trouvé',
+                }
+                details = to_classify[annonce_id]
+                llm_cache.set(classification_cache_key(details['description'], details['additional_info']), verdicts[annonce_id], expire=LLM_CACHE_TTL)
+    except (orjson.JSONDecodeError, KeyError, TypeError, AttributeError):
+        print(f"Failed to parse response from GPT: {response}")
+
+    return verdicts
+
+async def ask_gpt(description: str, additional_info: str, img: str, url: str, titre: str) -> dict:
+    """
+    Consult GPT-4 to summarize a real estate announcement deemed interesting by classify_announcements.
+
+    GPT-4 is asked to provide a summary with specific formatting including details such as price, area,
+    number of rooms, and general condition of the property. The summary is cached by announcement
+    content and model for LLM_CACHE_TTL seconds.
+
+    Args:
+        description (str): The description of the real estate property.
+        additional_info (str): Additional information that might be considered to summarize the property.
+        img (str): The image URL or path representing the property (if any).
+        url (str): The URL of the announcement.
+        titre (str): The title of the announcement given by classify_announcements.
+
+    Returns:
+        dict: A dictionary containing the title of the announcement, its URL, a boolean indicating it is
+              interesting, a summary provided by GPT-4, and the image path or URL.
+    """
+    cache_key = summary_cache_key(description, additional_info)
+    cached_resume = llm_cache.get(cache_key)
+    if cached_resume:
         return {
-            'titre': 'Titre non trouvé',
-            'interessante': False,
-            'resume': 'Description non trouvée',
+            'titre': titre,
+            'url': url,
+            'interessante': True,
+            'resume': cached_resume,
             'img': img
         }
-    
-    # Évaluer ici si les critères intéressants sont présents
-    est_interessante = texte_reponse.get("Interessante", False)
-
-    # Demandez un résumé si l'annonce est intéressante
-    resume = ""
-    if est_interessante:
-        print("Annonce intéressante, génération du résumé")
-        prompt_resume = (f"Donne-moi un résumé pertinent (prix, superficie, nombre de chambres, état général, critères, etc.) sous forme de bullet-point, formaté avec bold et italic, de cette annonce immobilière: {description}\n\n"
-                         f"Informations supplémentaires : {additional_info}\n\n"
-                         """
+
+    prompt_resume = (f"Donne-moi un résumé pertinent (prix, superficie, nombre de chambres, état général, critères, etc.) sous forme de bullet-point, formaté avec bold et italic, de cette annonce immobilière: {description}\n\n"
+                     f"Informations supplémentaires : {additional_info}\n\n"
+                     """
 Le format attendu pour le résumé est le suivant :
 **Localisation**
 - Quartier: [Nom du quartier], Angers ([code postal])
@@ -611,29 +1001,33 @@ Le format attendu pour le résumé est le suivant :
 **Informations complémentaires**
 - [Toute autre information intéressante sur le bien]
 - [Informations sur les risques si disponibles]
-                         """)
-        response_resume = openai.chat.completions.create(
-            model="gpt-4-1106-preview", 
-            messages=[
-                {"role": "system", "content": "Tu es un agent immobilier qui reçoit une description d'une annonce immobilière. Tu dois donner un résumé pertinent de cette annonce."},
-                {"role": "user", "content": prompt_resume},
-                ]
-            )
-        resume = response_resume.choices[0].message.content  # Fix the access to the response data
+                     """)
+    response_resume = await openai_client.chat.completions.create(
+        model=GPT_MODEL,
+        messages=[
+            {"role": "system", "content": "Tu es un agent immobilier qui reçoit une description d'une annonce immobilière. Tu dois donner un résumé pertinent de cette annonce."},
+            {"role": "user", "content": prompt_resume},
+            ]
+        )
+    resume = response_resume.choices[0].message.content  # Fix the access to the response data
+    llm_cache.set(cache_key, resume, expire=LLM_CACHE_TTL)
 
     return {
-        'titre': texte_reponse.get("Titre", 'Titre non trouvé'),
+        'titre': titre,
         'url': url,
-        'interessante': est_interessante,
+        'interessante': True,
         'resume': resume,
         'img': img
     }
 
 
 async def main():
-    announcements_data = get_announcements_data()
-    await parse_announcements(announcements_data)  # Wait for parse_announcements to complete
+    try:
+        announcements_data = await get_announcements_data()
+        async with tg_bot:  # Open the bot connection pool, closed once every message is sent
+            await parse_announcements(announcements_data)  # Wait for parse_announcements to complete
+    finally:
+        await http_client.aclose()
 
 if __name__ == "__main__":
-    import asyncio
     asyncio.run(main())  # Run the main function as an async event loop